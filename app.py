@@ -11,11 +11,18 @@ FIXES vs v9.2:
 """
 
 import streamlit as st
-import json, uuid, os, re, io
-import pandas as pd
+import json, uuid, os, re, io, csv
+import hashlib
+from operator import itemgetter
+from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is the fallback
+    orjson = None
+
 load_dotenv()
 
 from vcf_parser import parse_vcf, get_sample_vcf
@@ -27,37 +34,53 @@ from pdf_report import generate_pdf_report
 
 # ── Constants ─────────────────────────────────────────────────────────────────
 BASE_DIR  = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DIR = Path(BASE_DIR) / "sample_data"
 ALL_DRUGS = list(DRUG_RISK_TABLE.keys())
 GENE_DRUG_MAP = {
     "CODEINE": "CYP2D6", "WARFARIN": "CYP2C9", "CLOPIDOGREL": "CYP2C19",
     "SIMVASTATIN": "SLCO1B1", "AZATHIOPRINE": "TPMT", "FLUOROURACIL": "DPYD",
 }
-SEV_RANK = {"none": 0, "low": 1, "moderate": 2, "high": 3, "critical": 4}
+SEV_ORDER = ("none", "low", "moderate", "high", "critical")
+SEV_RANK  = {s: i for i, s in enumerate(SEV_ORDER)}
+_SEV_HIGH = SEV_RANK["high"]
+
+class _CfgTable(dict):
+    """Style table whose unknown keys resolve to a fallback entry — `CFG[k]` is a single
+    hash probe on the hot path instead of `CFG.get(k, CFG[fallback])`."""
+    __slots__ = ("fallback",)
+
+    def __init__(self, data, fallback):
+        super().__init__(data)
+        self.fallback = fallback
 
-RISK_CFG = {
+    def __missing__(self, key):
+        return dict.__getitem__(self, self.fallback)
+
+
+RISK_CFG = _CfgTable({
     "Safe":         {"color":"#16A34A","bg":"#F0FDF4","border":"#BBF7D0","text":"#14532D","tag_bg":"#DCFCE7","tag_text":"#15803D","shape":"●","severity_dot":"#16A34A"},
     "Adjust Dosage":{"color":"#D97706","bg":"#FFFBEB","border":"#FDE68A","text":"#78350F","tag_bg":"#FEF3C7","tag_text":"#92400E","shape":"▲","severity_dot":"#D97706"},
     "Toxic":        {"color":"#B91C1C","bg":"#FEF2F2","border":"#FECACA","text":"#7F1D1D","tag_bg":"#FEE2E2","tag_text":"#991B1B","shape":"⬛","severity_dot":"#DC2626"},
     "Ineffective":  {"color":"#6D28D9","bg":"#F5F3FF","border":"#DDD6FE","text":"#4C1D95","tag_bg":"#EDE9FE","tag_text":"#5B21B6","shape":"◆","severity_dot":"#7C3AED"},
     "Unknown":      {"color":"#475569","bg":"#F8FAFC","border":"#E2E8F0","text":"#334155","tag_bg":"#F1F5F9","tag_text":"#475569","shape":"?","severity_dot":"#64748B"},
-}
+}, fallback="Unknown")
 
-SEV_CFG = {
+SEV_CFG = _CfgTable({
     "none":     {"color":"#16A34A","bg":"#F0FDF4","border":"#BBF7D0","text":"#14532D","label":"None"},
     "low":      {"color":"#D97706","bg":"#FFFBEB","border":"#FDE68A","text":"#78350F","label":"Low"},
     "moderate": {"color":"#EA580C","bg":"#FFF7ED","border":"#FED7AA","text":"#7C2D12","label":"Moderate"},
     "high":     {"color":"#DC2626","bg":"#FEF2F2","border":"#FECACA","text":"#7F1D1D","label":"High"},
     "critical": {"color":"#B91C1C","bg":"#FFF1F1","border":"#FCA5A5","text":"#450A0A","label":"Critical"},
-}
+}, fallback="none")
 
-PHENO_CFG = {
+PHENO_CFG = _CfgTable({
     "PM":      {"bg":"#FEF2F2","border":"#FECACA","text":"#7F1D1D","bar":"#DC2626","label":"Poor Metabolizer","pct":5},
     "IM":      {"bg":"#FFFBEB","border":"#FDE68A","text":"#78350F","bar":"#D97706","label":"Intermediate Metabolizer","pct":45},
     "NM":      {"bg":"#F0FDF4","border":"#BBF7D0","text":"#14532D","bar":"#16A34A","label":"Normal Metabolizer","pct":100},
     "RM":      {"bg":"#EFF6FF","border":"#BFDBFE","text":"#1E3A8A","bar":"#2563EB","label":"Rapid Metabolizer","pct":115},
     "URM":     {"bg":"#FFF7ED","border":"#FED7AA","text":"#7C2D12","bar":"#EA580C","label":"Ultrarapid Metabolizer","pct":130},
     "Unknown": {"bg":"#F8FAFC","border":"#E2E8F0","text":"#475569","bar":"#94A3B8","label":"Unknown","pct":0},
-}
+}, fallback="Unknown")
 
 POP_FREQ = {
     "CYP2D6":  {"PM":7,"IM":10,"NM":77,"URM":6},
@@ -77,6 +100,9 @@ CHROM_INFO = {
     "DPYD":    {"chrom":"1","band":"p22.1","pos_mb":97.5},
 }
 CHROM_LEN = {"1":248.9,"6":170.8,"10":133.8,"12":133.3,"22":50.8}
+# Marker offset along the chromosome bar — derived from static data, so no per-card division
+CHROM_PCT = {gene: info["pos_mb"] / CHROM_LEN.get(info["chrom"], 200) * 100
+             for gene, info in CHROM_INFO.items()}
 
 PLAIN_PHENO = {
     "PM":"Your body barely processes this medicine",
@@ -115,6 +141,7 @@ PERSONAS = {
     "C":{"label":"Drug Interaction","file":"patient_c_interaction.vcf","drugs":["CLOPIDOGREL"],"desc":"CYP2C19 *2/*3 Poor Metabolizer","sev":"high"},
     "D":{"label":"All Safe","file":"patient_d_safe.vcf","drugs":["CODEINE","WARFARIN","SIMVASTATIN"],"desc":"Wildtype *1/*1 all genes","sev":"none"},
 }
+PERSONA_BY_LABEL = {p["label"]: p for p in PERSONAS.values()}
 
 TEST_SUITE = [
     {"name":"Mixed Variants","file":"sample.vcf","drugs":["CLOPIDOGREL","CODEINE","AZATHIOPRINE"],
@@ -137,7 +164,9 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-st.markdown("""<style>
+# Static stylesheet. Streamlit drops any element that is not re-emitted on a rerun, so this
+# has to be sent every run; keeping it as a module constant avoids rebuilding it in main().
+APP_CSS = """<style>
 @import url('https://fonts.googleapis.com/css2?family=DM+Sans:ital,opsz,wght@0,9..40,300;0,9..40,400;0,9..40,500;0,9..40,600;0,9..40,700;1,9..40,400&family=JetBrains+Mono:wght@400;500;600&display=swap');
 
 :root {
@@ -168,7 +197,7 @@ html,body,[class*="css"]{font-family:var(--font-body)!important;font-size:16px!i
 @keyframes fade-up{from{opacity:0;transform:translateY(12px)}to{opacity:1;transform:translateY(0)}}
 @keyframes fade-in{from{opacity:0}to{opacity:1}}
 @keyframes pulse-once{0%{transform:scale(1);box-shadow:0 0 0 0 rgba(185,28,28,.3)}40%{transform:scale(1.02);box-shadow:0 0 0 8px rgba(185,28,28,0)}100%{transform:scale(1);box-shadow:0 0 0 0 rgba(185,28,28,0)}}
-@keyframes bar-fill{from{width:0!important}}
+@keyframes bar-fill{from{transform:scaleX(0)}to{transform:scaleX(1)}}
 @keyframes score-count{from{opacity:0;transform:scale(.85)}to{opacity:1;transform:scale(1)}}
 
 .reveal-card{animation:fade-up .32s cubic-bezier(.4,0,.2,1) both;}
@@ -288,16 +317,16 @@ html,body,[class*="css"]{font-family:var(--font-body)!important;font-size:16px!i
 .pop-row{display:flex;align-items:center;gap:var(--sp-3);margin-bottom:var(--sp-2);}
 .pop-ph{font-family:var(--font-mono);font-size:.75rem;color:var(--text-secondary)!important;width:96px;flex-shrink:0;font-weight:500;}
 .pop-track{flex:1;height:4px;background:var(--surface-sub);border-radius:2px;overflow:hidden;}
-.pop-fill{height:100%;border-radius:2px;animation:bar-fill .7s cubic-bezier(.4,0,.2,1) both;}
+.pop-fill{height:100%;border-radius:2px;transform-origin:left;animation:bar-fill .7s cubic-bezier(.4,0,.2,1) both;}
 .pop-pct{font-family:var(--font-mono);font-size:.7rem;width:32px;text-align:right;color:var(--text-muted)!important;}
 .pop-you{font-family:var(--font-mono);font-size:.65rem;color:var(--brand)!important;font-weight:700;margin-left:3px;}
 
 .ix-grid{display:grid;gap:3px;}
-.ix-cell{border-radius:var(--r-sm);display:flex;align-items:center;justify-content:center;min-height:44px;font-family:var(--font-mono);font-size:.65rem;text-align:center;padding:var(--sp-1);font-weight:700;border:1.5px solid;transition:transform .12s,box-shadow .12s;}
-.ix-cell:hover{transform:scale(1.06);z-index:5;position:relative;box-shadow:var(--shadow-md);}
+.ix-cell{border-radius:var(--r-sm);display:flex;align-items:center;justify-content:center;min-height:44px;font-family:var(--font-mono);font-size:.65rem;text-align:center;padding:var(--sp-1);font-weight:700;border:1.5px solid;transition:transform .12s,box-shadow .12s;position:relative;contain:paint;}
+.ix-cell:hover{transform:translateZ(0) scale(1.06);z-index:5;box-shadow:var(--shadow-md);}
 .ix-head{font-family:var(--font-mono);font-size:.65rem;letter-spacing:.05em;color:var(--text-muted)!important;display:flex;align-items:center;justify-content:center;min-height:44px;}
 
-.dcard{background:var(--surface);border:1px solid var(--border-light);border-radius:var(--r-2xl);margin-bottom:var(--sp-6);overflow:hidden;box-shadow:var(--shadow-sm);transition:box-shadow .2s;}
+.dcard{background:var(--surface);border:1px solid var(--border-light);border-radius:var(--r-2xl);margin-bottom:var(--sp-6);overflow:hidden;box-shadow:var(--shadow-sm);transition:box-shadow .2s;contain:paint;}
 .dcard:hover{box-shadow:var(--shadow-md);}
 .dcard-header{display:flex;align-items:center;justify-content:space-between;padding:var(--sp-5) var(--sp-6);border-bottom:1px solid var(--border-light);}
 .dcard-left{display:flex;align-items:center;gap:var(--sp-4);}
@@ -314,7 +343,7 @@ html,body,[class*="css"]{font-family:var(--font-body)!important;font-size:16px!i
 .conf-grid{display:grid;grid-template-columns:1fr 1fr;gap:var(--sp-5);margin-bottom:var(--sp-5);}
 .conf-label{font-family:var(--font-mono);font-size:.65rem;font-weight:600;letter-spacing:.08em;text-transform:uppercase;color:var(--text-muted)!important;display:flex;justify-content:space-between;margin-bottom:5px;}
 .conf-track{height:4px;background:var(--surface-sub);border-radius:2px;overflow:hidden;}
-.conf-fill{height:100%;border-radius:2px;animation:bar-fill .7s cubic-bezier(.4,0,.2,1) both;}
+.conf-fill{height:100%;border-radius:2px;transform-origin:left;animation:bar-fill .7s cubic-bezier(.4,0,.2,1) both;}
 
 .vtable{width:100%;border-collapse:collapse;}
 .vtable th{font-family:var(--font-mono);font-size:.65rem;font-weight:600;letter-spacing:.1em;text-transform:uppercase;color:var(--text-muted)!important;padding:0 var(--sp-3) var(--sp-3);text-align:left;border-bottom:1px solid var(--border-light);}
@@ -373,7 +402,7 @@ html,body,[class*="css"]{font-family:var(--font-body)!important;font-size:16px!i
 .patient-banner{border-radius:var(--r-xl);padding:var(--sp-6);margin-bottom:var(--sp-6);border:1.5px solid;box-shadow:var(--shadow-md);}
 .patient-banner-title{font-size:1.125rem;font-weight:700;margin-bottom:var(--sp-2);}
 .patient-banner-sub{font-size:.9rem;line-height:1.7;}
-.pcard{background:var(--surface);border:1.5px solid;border-radius:var(--r-xl);padding:var(--sp-6);margin-bottom:var(--sp-4);box-shadow:var(--shadow-sm);animation:fade-up .3s ease both;transition:box-shadow .2s;}
+.pcard{background:var(--surface);border:1.5px solid;border-radius:var(--r-xl);padding:var(--sp-6);margin-bottom:var(--sp-4);box-shadow:var(--shadow-sm);animation:fade-up .3s ease both;transition:box-shadow .2s;contain:paint;}
 .pcard:hover{box-shadow:var(--shadow-md);}
 .pcard-drug{font-size:1.1rem;font-weight:700;letter-spacing:-.02em;margin-bottom:3px;}
 .pcard-verdict{font-size:.9rem;font-weight:600;line-height:1.5;margin-bottom:var(--sp-2);}
@@ -530,53 +559,117 @@ div[data-testid="stExpander"] [data-testid="stExpanderDetails"]{color:var(--text
 pre,code{font-family:var(--font-mono)!important;color:#334155!important;white-space:pre-wrap!important;word-break:break-word!important;}
 [data-testid="stCodeBlock"] pre,[data-testid="stCodeBlock"] code{background:#F1F5F9!important;color:#0F172A!important;}
 .stJson *{color:var(--text-primary)!important;}
-</style>""", unsafe_allow_html=True)
+</style>"""
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 # UTILITY FUNCTIONS
 # ══════════════════════════════════════════════════════════════════════════════
 
+@st.cache_data(show_spinner=False, max_entries=32)
 def load_vcf(filename):
-    """Load a VCF file from sample_data/. Falls back to get_sample_vcf() if not found."""
-    p = os.path.join(BASE_DIR, "sample_data", filename)
-    if os.path.exists(p):
-        return open(p).read()
+    """Load a VCF file from sample_data/. Callers fall back to get_sample_vcf() if not found.
+
+    Sample files ship with the app and never change, so reads are memoized per filename
+    (a missing file raises and is therefore not cached). st.cache_data rather than lru_cache:
+    this script is re-executed on every rerun, which would discard a module-level cache."""
+    p = SAMPLE_DIR / filename
+    if p.is_file():
+        return p.read_text()
     # FIX: graceful fallback instead of silent empty string
     raise FileNotFoundError(f"Sample file not found: {p}")
 
+@st.cache_data(show_spinner=False, max_entries=8)
+def _parse_stage(vcf_sig, _vcf):
+    return parse_vcf(_vcf)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _risk_stage(vcf_sig, drugs, _parsed):
+    return run_risk_assessment(_parsed, list(drugs))
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _explain_stage(vcf_sig, drugs, skip_llm, has_key, _results, _key):
+    # Raw key stays out of the cache key; only whether one was given changes the output
+    return generate_all_explanations(_key, _results, skip_llm=skip_llm)
+
 def run_pipeline(vcf, drugs, pid, key, run_ix=True, gen_pdf=True, skip_llm=False):
-    parsed  = parse_vcf(vcf)
-    results = run_risk_assessment(parsed, drugs)
-    results = generate_all_explanations(key, results, skip_llm=skip_llm)
+    """Staged pipeline — each stage is memoized on the inputs it depends on, so changing
+    the drug list skips re-parsing and changing the patient ID skips the LLM stage."""
+    drugs   = tuple(drugs)
+    vcf_sig = hashlib.blake2b(vcf.encode(), digest_size=16).hexdigest()
+    parsed  = _parse_stage(vcf_sig, vcf)
+    results = _risk_stage(vcf_sig, drugs, parsed)
+    results = _explain_stage(vcf_sig, drugs, skip_llm, bool(key), results, key)
     outputs = [build_output_schema(patient_id=pid, drug=r["drug"], result=r,
                 parsed_vcf=parsed, llm_exp=r.get("llm_explanation", {})) for r in results]
-    ix  = run_interaction_analysis(drugs, results) if run_ix and len(drugs) > 1 else None
+    ix  = run_interaction_analysis(list(drugs), results) if run_ix and len(drugs) > 1 else None
     pdf = None
     if gen_pdf:
         try:
-            pdf = generate_pdf_report(pid, outputs, parsed)
+            # download_button takes bytes, not bytearray — the one copy happens here at the UI boundary
+            pdf = bytes(generate_pdf_report(pid, outputs, parsed))
         except Exception:
             pass
     return parsed, results, outputs, ix, pdf
 
+def to_json_bytes(obj):
+    """Pretty-printed JSON payload for download buttons (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode("utf-8")
+
+# FUNCTION= values emitted by the sample VCFs and the parser default
+_FUNC_CLS = {"no_function": "v-nofunc", "decreased_function": "v-dec", "normal_function": "v-norm",
+             "increased_function": "v-norm", "Unknown": "v-norm", "unknown": "v-norm", "": "v-norm"}
+
 def func_cls(status):
-    s = (status or "").lower()
+    cls = _FUNC_CLS.get(status or "")
+    if cls is not None:
+        return cls
+    s = status.lower()
     if "no_function" in s or "no function" in s:
         return "v-nofunc"
     if any(x in s for x in ["decreased","splice","missense","frame","stop","pathogenic"]) and "synonymous" not in s:
         return "v-dec"
     return "v-norm"
 
+_VARIANT_STATUS = {}
+
+def variant_status(status):
+    """(css class, display label) for a variant's functional status; memoized per distinct status."""
+    hit = _VARIANT_STATUS.get(status)
+    if hit is None:
+        hit = _VARIANT_STATUS[status] = (func_cls(status), (status or "unknown").replace("_", " ").title())
+    return hit
+
+def sec_html(label):
+    return f'<div class="sec-label">{label}</div>'
+
 def sec(label):
-    st.markdown(f'<div class="sec-label">{label}</div>', unsafe_allow_html=True)
+    st.markdown(sec_html(label), unsafe_allow_html=True)
 
-def risk_badge_html(rl):
-    rc = RISK_CFG.get(rl, RISK_CFG["Unknown"])
+def emit_html(*parts):
+    """Emit several rendered HTML sections as one markdown element (one DOM node, one delta)."""
+    html = "".join(p.strip() for p in parts if p)
+    if html:
+        st.markdown(html, unsafe_allow_html=True)
+
+def _risk_badge(rl, rc):
     return (f'<span class="risk-badge" style="background:{rc["tag_bg"]};color:{rc["tag_text"]};'
             f'border-color:{rc["border"]};">'
             f'<span style="font-size:.8rem;">{rc["shape"]}</span>{rl}</span>')
 
+# Per-risk-label HTML fragments — invariant, so formatted once per script run rather than per cell
+_RISK_BADGE = {rl: _risk_badge(rl, rc) for rl, rc in RISK_CFG.items()}
+_PH_CHIP_STYLE = _CfgTable({rl: (f'font-family:var(--font-mono);font-size:.8rem;color:{rc["tag_text"]};background:{rc["tag_bg"]};'
+                                 f'border:1px solid {rc["border"]};padding:2px 8px;border-radius:4px;font-weight:600;')
+                            for rl, rc in RISK_CFG.items()}, fallback="Unknown")
+_HM_CELL_STYLE = _CfgTable({rl: (f'background:{rc["bg"]};border-color:{rc["border"]};', f'color:{rc["text"]};')
+                            for rl, rc in RISK_CFG.items()}, fallback="Unknown")
+
+def risk_badge_html(rl):
+    return _RISK_BADGE.get(rl) or _risk_badge(rl, RISK_CFG["Unknown"])
+
 def clean_model_label(raw_model: str):
     is_static = "static" in raw_model.lower()
     if is_static:
@@ -589,42 +682,48 @@ def clean_model_label(raw_model: str):
 # VISUAL COMPONENTS (unchanged from v9.2)
 # ══════════════════════════════════════════════════════════════════════════════
 
+PGX_SEV_SCORE   = {"none": 0, "low": 20, "moderate": 45, "high": 70, "critical": 100}
+PGX_RISK_SCORE  = {"Safe": 0, "Adjust Dosage": 35, "Toxic": 85, "Ineffective": 70, "Unknown": 20}
+PGX_DRUG_WEIGHT = {"FLUOROURACIL": 1.4, "AZATHIOPRINE": 1.3, "CLOPIDOGREL": 1.3,
+                   "WARFARIN": 1.2, "CODEINE": 1.1, "SIMVASTATIN": 1.0}
+
+PGX_LABELS = ("Low Risk", "Moderate Risk", "High Risk", "Very High Risk", "Critical Risk")
+PGX_COLORS = ("#16A34A", "#D97706", "#EA580C", "#DC2626", "#B91C1C")
+_PGX_THRESH_HTML = """<div class="pgx-thresh-labels">
+        <span>0 — No Risk</span><span>25</span><span>50 — High</span><span>75</span><span>100 — Critical</span>
+      </div>"""
+
+
 def compute_pgx(outputs):
-    SEV_S  = {"none": 0, "low": 20, "moderate": 45, "high": 70, "critical": 100}
-    RISK_S = {"Safe": 0, "Adjust Dosage": 35, "Toxic": 85, "Ineffective": 70, "Unknown": 20}
-    W      = {"FLUOROURACIL": 1.4, "AZATHIOPRINE": 1.3, "CLOPIDOGREL": 1.3,
-               "WARFARIN": 1.2, "CODEINE": 1.1, "SIMVASTATIN": 1.0}
+    """Score, label, band index and gene pills in a single pass over the outputs."""
+    SEV_S, RISK_S, W = PGX_SEV_SCORE, PGX_RISK_SCORE, PGX_DRUG_WEIGHT
     if not outputs:
-        return 0, "No data", []
+        return 0, "No data", 0, ""
     tw = ws = 0
-    bd = []
+    pills = []
     for o in outputs:
         drug = o["drug"]
-        sev  = o["risk_assessment"]["severity"]
-        rl   = o["risk_assessment"]["risk_label"]
-        gene = o["pharmacogenomic_profile"]["primary_gene"]
-        ph   = o["pharmacogenomic_profile"]["phenotype"]
+        ra, pg = o["risk_assessment"], o["pharmacogenomic_profile"]
+        sev  = ra["severity"]
+        rl   = ra["risk_label"]
+        gene = pg["primary_gene"]
+        ph   = pg["phenotype"]
         sc   = (SEV_S.get(sev, 0) + RISK_S.get(rl, 0)) / 2
         wt   = W.get(drug, 1.0)
         ws  += sc * wt
         tw  += wt
-        bd.append((gene, drug, ph, rl, sc))
-    final = min(100, int(ws / tw)) if tw else 0
-    labels = ["Low Risk", "Moderate Risk", "High Risk", "Very High Risk", "Critical Risk"]
-    label  = labels[min(4, final // 20)]
-    return final, label, bd
-
-
-def render_pgx(outputs):
-    score, label, bd = compute_pgx(outputs)
-    SCORE_COLORS = ["#16A34A", "#D97706", "#EA580C", "#DC2626", "#B91C1C"]
-    color = SCORE_COLORS[min(4, score // 20)]
-    pills = ""
-    for gene, _, ph, rl, _ in bd:
-        rc = RISK_CFG.get(rl, RISK_CFG["Unknown"])
-        pills += (f'<span class="pgx-pill" style="background:{rc["tag_bg"]};border-color:{rc["border"]};'
-                  f'color:{rc["tag_text"]};">{gene} · {ph}</span>')
-    st.markdown(f"""
+        rc   = RISK_CFG[rl]
+        pills.append(f'<span class="pgx-pill" style="background:{rc["tag_bg"]};border-color:{rc["border"]};'
+                     f'color:{rc["tag_text"]};">{gene} · {ph}</span>')
+    final  = min(100, int(ws / tw)) if tw else 0
+    bucket = min(4, final // 20)
+    return final, PGX_LABELS[bucket], bucket, "".join(pills)
+
+
+def pgx_html(outputs):
+    score, label, bucket, pills = compute_pgx(outputs)
+    color = PGX_COLORS[bucket]
+    return f"""
     <div class="pgx-card">
       <div class="pgx-eyebrow">Polygenic Risk Score</div>
       <div class="pgx-score" style="color:{color};">{score}</div>
@@ -633,23 +732,23 @@ def render_pgx(outputs):
         <div class="pgx-fill" style="width:{score}%;background:linear-gradient(90deg,{color}99,{color});"></div>
         <div class="pgx-indicator" style="left:{score}%;border-color:{color};"></div>
       </div>
-      <div class="pgx-thresh-labels">
-        <span>0 — No Risk</span><span>25</span><span>50 — High</span><span>75</span><span>100 — Critical</span>
-      </div>
+      {_PGX_THRESH_HTML}
       <div class="pgx-pills">{pills}</div>
-    </div>""", unsafe_allow_html=True)
+    </div>"""
 
 
-def render_risk_center(outputs, parsed):
-    sev = max((o["risk_assessment"]["severity"] for o in outputs),
-              key=lambda s: SEV_RANK.get(s, 0), default="none")
-    sp  = SEV_CFG.get(sev, SEV_CFG["none"])
-    EMO = {"none": "✓", "low": "△", "moderate": "⚠", "high": "⛔", "critical": "🚨"}
-    hc  = sum(1 for o in outputs if o["risk_assessment"]["severity"] in ("high", "critical"))
-    st.markdown(f"""
+SEV_EMOJI = {"none": "✓", "low": "△", "moderate": "⚠", "high": "⛔", "critical": "🚨"}
+
+
+def risk_center_html(outputs, parsed):
+    ranks = [SEV_RANK.get(o["risk_assessment"]["severity"], 0) for o in outputs]
+    sev = SEV_ORDER[max(ranks, default=0)]
+    sp  = SEV_CFG[sev]
+    hc  = sum(r >= _SEV_HIGH for r in ranks)
+    return f"""
     <div class="risk-center" style="background:{sp['bg']};border-color:{sp['border']};color:{sp['text']};">
       <div class="rc-eyebrow">Risk Command Center</div>
-      <div class="rc-headline">{EMO.get(sev,"")} {sp['label']} Risk Profile</div>
+      <div class="rc-headline">{SEV_EMOJI.get(sev,"")} {sp['label']} Risk Profile</div>
       <div class="rc-sub">Patient pharmacogenomic assessment across {len(outputs)} medication{"s" if len(outputs)!=1 else ""}</div>
       <div class="rc-stats" style="border-top-color:{sp['border']}88;">
         <div><div class="rc-stat-num">{len(outputs)}</div><div class="rc-stat-lbl">Drugs Assessed</div></div>
@@ -657,27 +756,29 @@ def render_risk_center(outputs, parsed):
         <div><div class="rc-stat-num">{len(parsed.get('detected_genes',[]))}</div><div class="rc-stat-lbl">Genes Detected</div></div>
         <div><div class="rc-stat-num">{parsed.get('total_variants',0)}</div><div class="rc-stat-lbl">Variants Found</div></div>
       </div>
-    </div>""", unsafe_allow_html=True)
+    </div>"""
 
 
-def render_critical_alerts(outputs):
-    for o in outputs:
-        if o["risk_assessment"]["severity"] == "critical":
-            drug = o["drug"]
-            note = o["clinical_recommendation"]["dosing_recommendation"][:240]
-            st.markdown(f"""
-            <div class="crit-alert">
-              <div style="font-size:1.25rem;flex-shrink:0;padding-top:1px;">🚨</div>
-              <div>
-                <div class="crit-title">Critical Safety Alert — {drug}</div>
-                <div class="crit-note">{note}{"…" if len(o["clinical_recommendation"]["dosing_recommendation"])>240 else ""}</div>
-                <div class="crit-action">⚡ Contact prescribing physician immediately</div>
-              </div>
-            </div>""", unsafe_allow_html=True)
-
-
-def render_disclaimer():
-    st.markdown("""
+def critical_alerts_html(critical):
+    """Alert banners for the pre-filtered critical-severity outputs."""
+    alerts = []
+    for o in critical:
+        drug = o["drug"]
+        cr = o["clinical_recommendation"]
+        note = cr["dosing_recommendation"][:240]
+        alerts.append(f"""
+        <div class="crit-alert">
+          <div style="font-size:1.25rem;flex-shrink:0;padding-top:1px;">🚨</div>
+          <div>
+            <div class="crit-title">Critical Safety Alert — {drug}</div>
+            <div class="crit-note">{note}{"…" if len(cr["dosing_recommendation"])>240 else ""}</div>
+            <div class="crit-action">⚡ Contact prescribing physician immediately</div>
+          </div>
+        </div>""")
+    return "".join(alerts)
+
+
+DISCLAIMER_HTML = """
     <div class="disclaimer-box">
       <span style="font-size:1rem;flex-shrink:0;">📋</span>
       <div class="disclaimer-text">
@@ -685,166 +786,199 @@ def render_disclaimer():
         clinical pharmacologist or geneticist before any medication changes. All recommendations are
         based on CPIC Level A evidence — verify at <strong>cpicpgx.org</strong>.
       </div>
-    </div>""", unsafe_allow_html=True)
+    </div>"""
 
 
-def render_gene_row(outputs):
+def gene_row_html(outputs):
     GENE_ORDER = ["CYP2D6", "CYP2C19", "CYP2C9", "SLCO1B1", "TPMT", "DPYD"]
     gp = {o["pharmacogenomic_profile"]["primary_gene"]: o["pharmacogenomic_profile"]["phenotype"]
           for o in outputs}
-    boxes = ""
+    boxes = []
     for g in GENE_ORDER:
         ph = gp.get(g, "Unknown")
-        pc = PHENO_CFG.get(ph, PHENO_CFG["Unknown"])
+        pc = PHENO_CFG[ph]
         bar = min(100, pc["pct"])
         active = "active" if g in gp else ""
-        boxes += f"""
+        boxes.append(f"""
         <div class="gene-box {active}" style="{'border-color:'+pc['border']+';' if active else ''}">
           <div class="gene-nm" style="{'color:'+pc['text']+';' if active else ''}">{g}</div>
           <div class="gene-track">
             <div class="gene-fill" style="width:{bar}%;background:{pc['bar']};"></div>
           </div>
           <div class="gene-ph" style="color:{pc['text'] if active else 'var(--text-xmuted)'};">{ph}</div>
-        </div>"""
-    sec("Gene Activity Overview")
-    st.markdown(f'<div class="gene-row">{boxes}</div>', unsafe_allow_html=True)
+        </div>""")
+    return sec_html("Gene Activity Overview") + f'<div class="gene-row">{"".join(boxes)}</div>'
 
 
-def render_drug_table(outputs, pid):
-    rows = ""
-    data = []
+def csv_text(rows):
+    buf = io.StringIO()
+    out = csv.writer(buf, lineterminator="\n")
+    out.writerow(("Drug", "Risk", "Severity", "Gene", "Phenotype", "Confidence"))
+    out.writerows(rows)
+    return buf.getvalue()
+
+
+def drug_table_html(outputs):
+    """Summary table markup plus the matching CSV text for the download button."""
+    rows = []
+    csv_rows = []
     for o in outputs:
         drug = o["drug"]
-        rl   = o["risk_assessment"]["risk_label"]
-        sev  = o["risk_assessment"]["severity"]
-        conf = o["risk_assessment"]["confidence_score"]
-        gene = o["pharmacogenomic_profile"]["primary_gene"]
-        ph   = o["pharmacogenomic_profile"]["phenotype"]
-        rc   = RISK_CFG.get(rl, RISK_CFG["Unknown"])
-        sp   = SEV_CFG.get(sev, SEV_CFG["none"])
+        ra, pg = o["risk_assessment"], o["pharmacogenomic_profile"]
+        rl   = ra["risk_label"]
+        sev  = ra["severity"]
+        conf = ra["confidence_score"]
+        gene = pg["primary_gene"]
+        ph   = pg["phenotype"]
+        rc   = RISK_CFG[rl]
+        sp   = SEV_CFG[sev]
         badge = risk_badge_html(rl)
-        rows += f"""<div class="dtab-row">
+        rows.append(f"""<div class="dtab-row">
           <div class="dtab-cell" style="font-weight:700;color:#0F172A;">{drug.title()}</div>
           <div class="dtab-cell">{badge}</div>
           <div class="dtab-cell"><span style="color:{sp['text']};font-weight:600;">{sp['label']}</span></div>
           <div class="dtab-cell" style="font-family:var(--font-mono);font-size:.8rem;color:#64748B;">{gene}</div>
-          <div class="dtab-cell"><span style="font-family:var(--font-mono);font-size:.8rem;color:{rc['tag_text']};background:{rc['tag_bg']};border:1px solid {rc['border']};padding:2px 8px;border-radius:4px;font-weight:600;">{ph}</span></div>
+          <div class="dtab-cell"><span style="{_PH_CHIP_STYLE[rl]}">{ph}</span></div>
           <div class="dtab-cell">
             <div style="flex:1;height:4px;background:#E8EDF5;border-radius:2px;overflow:hidden;margin-right:8px;">
               <div style="width:{conf*100:.0f}%;height:100%;background:{rc['severity_dot']};border-radius:2px;"></div>
             </div>
             <span style="font-family:var(--font-mono);font-size:.75rem;color:#64748B;font-weight:600;">{conf:.0%}</span>
           </div>
-        </div>"""
-        data.append({"Drug": drug, "Risk": rl, "Severity": sev, "Gene": gene,
-                      "Phenotype": ph, "Confidence": f"{conf:.0%}"})
-    sec("Drug Risk Summary")
-    st.markdown(f"""
+        </div>""")
+        csv_rows.append((drug, rl, sev, gene, ph, f"{conf:.0%}"))
+    return sec_html("Drug Risk Summary") + f"""
     <div class="dtab">
       <div class="dtab-head">
         <div class="dtab-hcell">Drug</div><div class="dtab-hcell">Risk Label</div>
         <div class="dtab-hcell">Severity</div><div class="dtab-hcell">Gene</div>
         <div class="dtab-hcell">Phenotype</div><div class="dtab-hcell">Confidence</div>
-      </div>{rows}
-    </div>""", unsafe_allow_html=True)
-    df = pd.DataFrame(data)
-    st.download_button("⬇ Download CSV", data=df.to_csv(index=False),
+      </div>{"".join(rows)}
+    </div>""", csv_text(csv_rows)
+
+
+def render_csv_download(csv_data, pid):
+    st.download_button("⬇ Download CSV", data=csv_data,
         file_name=f"SurakshaRx_{pid}.csv", mime="text/csv", key=f"csv_{pid}")
 
 
-def render_heatmap(outputs):
-    DRUG_ORD = ["CODEINE","WARFARIN","CLOPIDOGREL","SIMVASTATIN","AZATHIOPRINE","FLUOROURACIL"]
-    GENE_ORD = ["CYP2D6","CYP2C9","CYP2C19","SLCO1B1","TPMT","DPYD"]
-    DG = {"CODEINE":"CYP2D6","WARFARIN":"CYP2C9","CLOPIDOGREL":"CYP2C19",
-          "SIMVASTATIN":"SLCO1B1","AZATHIOPRINE":"TPMT","FLUOROURACIL":"DPYD"}
+HM_DRUG_ORDER = ("CODEINE","WARFARIN","CLOPIDOGREL","SIMVASTATIN","AZATHIOPRINE","FLUOROURACIL")
+HM_GENE_ORDER = ("CYP2D6","CYP2C9","CYP2C19","SLCO1B1","TPMT","DPYD")
+_HM_SHORT = {"Adjust Dosage":"Adjust","Ineffective":"Ineffect.","Unknown":"?"}
+_HM_EMPTY_CELL = '<div class="hm-cell" style="background:#F1F5F9;border-color:#E8EDF5;"><div class="hm-cell-risk" style="color:#94A3B8;">—</div></div>'
+_HM_LEGEND_HTML = "".join(
+    f'<div class="hm-legend-item"><span class="hm-dot" style="background:{RISK_CFG[r]["bg"]};border-color:{RISK_CFG[r]["border"]};"></span><span>{RISK_CFG[r]["shape"]} {r}</span></div>'
+    for r in ["Safe", "Adjust Dosage", "Toxic", "Ineffective"])
+
+
+def heatmap_html(outputs):
+    DG    = GENE_DRUG_MAP
     rmap  = {o["drug"]: o for o in outputs}
-    drugs = [d for d in DRUG_ORD if d in rmap]
+    drugs = [d for d in HM_DRUG_ORDER if d in rmap]
     if not drugs:
-        return
+        return ""
     n = len(drugs)
-    hdrs = '<div class="hm-header"></div>'
-    for d in drugs:
-        hdrs += f'<div class="hm-header">{d[:5]}</div>'
-    rows = ""
-    for gene in GENE_ORD:
-        rows += f'<div class="hm-header" style="justify-content:flex-end;padding-right:6px;">{gene}</div>'
+    hdrs = '<div class="hm-header"></div>' + "".join(f'<div class="hm-header">{d[:5]}</div>' for d in drugs)
+    rows = []
+    for gene in HM_GENE_ORDER:
+        rows.append(f'<div class="hm-header" style="justify-content:flex-end;padding-right:6px;">{gene}</div>')
         for d in drugs:
             if DG.get(d) == gene and d in rmap:
                 o  = rmap[d]
-                rl = o["risk_assessment"]["risk_label"]
-                ph = o["pharmacogenomic_profile"]["phenotype"]
-                rc = RISK_CFG.get(rl, RISK_CFG["Unknown"])
-                sh = {"Adjust Dosage":"Adjust","Ineffective":"Ineffect.","Unknown":"?"}.get(rl, rl)
-                rows += (f'<div class="hm-cell" style="background:{rc["bg"]};border-color:{rc["border"]};" '
+                ra, pg = o["risk_assessment"], o["pharmacogenomic_profile"]
+                rl = ra["risk_label"]
+                ph = pg["phenotype"]
+                cell, txt = _HM_CELL_STYLE[rl]
+                sh = _HM_SHORT.get(rl, rl)
+                rows.append(f'<div class="hm-cell" style="{cell}" '
                          f'title="{d}×{gene}: {rl} ({ph})">'
-                         f'<div class="hm-cell-name" style="color:{rc["text"]};">{sh}</div>'
-                         f'<div class="hm-cell-risk" style="color:{rc["text"]};">{ph}</div></div>')
+                         f'<div class="hm-cell-name" style="{txt}">{sh}</div>'
+                         f'<div class="hm-cell-risk" style="{txt}">{ph}</div></div>')
             else:
-                rows += '<div class="hm-cell" style="background:#F1F5F9;border-color:#E8EDF5;"><div class="hm-cell-risk" style="color:#94A3B8;">—</div></div>'
-    legend = "".join(
-        f'<div class="hm-legend-item"><span class="hm-dot" style="background:{RISK_CFG[r]["bg"]};border-color:{RISK_CFG[r]["border"]};"></span><span>{RISK_CFG[r]["shape"]} {r}</span></div>'
-        for r in ["Safe", "Adjust Dosage", "Toxic", "Ineffective"])
-    st.markdown(f"""
+                rows.append(_HM_EMPTY_CELL)
+    return f"""
     <div class="hm-wrap">
       <div class="hm-eyebrow">Drug × Gene Risk Matrix</div>
-      <div class="hm-grid" style="grid-template-columns:80px repeat({n},1fr);">{hdrs}{rows}</div>
-      <div class="hm-legend">{legend}</div>
-    </div>""", unsafe_allow_html=True)
-
-
-def render_chromosome(outputs, parsed):
-    det  = set(parsed.get("detected_genes", []))
-    rmap = {o["pharmacogenomic_profile"]["primary_gene"]: o for o in outputs}
-    rows = ""
-    for gene, info in CHROM_INFO.items():
-        ch  = info["chrom"]
-        pos = info["pos_mb"]
-        pct = (pos / CHROM_LEN.get(ch, 200)) * 100
-        if gene in rmap:
-            rl = rmap[gene]["risk_assessment"]["risk_label"]
-            mc = RISK_CFG.get(rl, RISK_CFG["Unknown"])["severity_dot"]
-        elif gene in det:
-            mc = "#94A3B8"
-        else:
-            mc = "#DDE3EE"
-        rows += f"""<div class="chrom-row">
-          <div class="chrom-chr">{ch}</div>
+      <div class="hm-grid" style="grid-template-columns:80px repeat({n},1fr);">{hdrs}{"".join(rows)}</div>
+      <div class="hm-legend">{_HM_LEGEND_HTML}</div>
+    </div>"""
+
+
+def _chrom_row_html(gene, rl, detected):
+    """One chromosome bar. The marker colour is fixed by the gene's risk label (None when no
+    selected drug targets it) and whether a variant was detected."""
+    if rl is not None:
+        mc = RISK_CFG[rl]["severity_dot"]
+    elif detected:
+        mc = "#94A3B8"
+    else:
+        mc = "#DDE3EE"
+    info = CHROM_INFO[gene]
+    return f"""<div class="chrom-row">
+          <div class="chrom-chr">{info['chrom']}</div>
           <div class="chrom-bar">
             <div class="chrom-body"></div>
-            <div class="chrom-marker" style="left:{pct}%;background:{mc};box-shadow:0 0 5px {mc}88;"></div>
+            <div class="chrom-marker" style="left:{CHROM_PCT[gene]}%;background:{mc};box-shadow:0 0 5px {mc}88;"></div>
           </div>
           <div class="chrom-gene">{gene}</div>
           <div class="chrom-band">{info['band']}</div>
         </div>"""
-    st.markdown(f"""
+
+
+def chromosome_html(outputs, parsed):
+    det     = frozenset(parsed.get("detected_genes", ()))
+    gene_rl = {o["pharmacogenomic_profile"]["primary_gene"]: o["risk_assessment"]["risk_label"]
+               for o in outputs}
+    rows = "".join(_chrom_row_html(gene, gene_rl.get(gene), gene in det) for gene in CHROM_INFO)
+    return f"""
     <div class="chrom-wrap">
       <div class="chrom-eyebrow">Variant Chromosome Locations</div>
       {rows}
       <div style="font-family:var(--font-mono);font-size:.65rem;color:#94A3B8;margin-top:var(--sp-3);">
         Coloured markers = variants detected · Grey = undetected
       </div>
-    </div>""", unsafe_allow_html=True)
+    </div>"""
 
 
-def render_pop_freq(gene, ph):
-    freq = POP_FREQ.get(gene, {})
+def pop_freq_html(gene, ph):
+    freq = POP_FREQ.get(gene)
     if not freq:
-        return
-    rows = ""
+        return ""
+    rows = []
     for p, pct in sorted(freq.items(), key=lambda x: -x[1]):
         you = (p == ph)
-        pc  = PHENO_CFG.get(p, PHENO_CFG["Unknown"])
+        pc  = PHENO_CFG[p]
+        bar = pct if pct < 100 else 100
         you_tag = f'<span class="pop-you">← You</span>' if you else ""
         w = "font-weight:700;" if you else ""
-        rows += f"""<div class="pop-row">
+        rows.append(f"""<div class="pop-row">
           <div class="pop-ph" style="{w}{'color:'+pc['text']+';' if you else ''}">{pc['label']}</div>
-          <div class="pop-track"><div class="pop-fill" style="width:{min(pct,100)}%;background:{pc['bar'] if you else '#CBD5E1'};"></div></div>
+          <div class="pop-track"><div class="pop-fill" style="width:{bar}%;background:{pc['bar'] if you else '#CBD5E1'};"></div></div>
           <div class="pop-pct" style="{w}{'color:'+pc['text']+';' if you else ''}">{pct}%{you_tag}</div>
-        </div>"""
-    st.markdown(f"""
+        </div>""")
+    return f"""
     <div class="pop-wrap">
-      <div class="pop-eyebrow">{gene} — Population Distribution</div>{rows}
-    </div>""", unsafe_allow_html=True)
+      <div class="pop-eyebrow">{gene} — Population Distribution</div>{"".join(rows)}
+    </div>"""
+
+
+IX_CELL_CFG = {
+    "critical": {"bg":"#FEF2F2","text":"#7F1D1D","border":"#FECACA"},
+    "high":     {"bg":"#FEF2F2","text":"#7F1D1D","border":"#FECACA"},
+    "moderate": {"bg":"#FFFBEB","text":"#78350F","border":"#FDE68A"},
+    "low":      {"bg":"#FEFCE8","text":"#713F12","border":"#FDE047"},
+    "none":     {"bg":"#F0FDF4","text":"#14532D","border":"#BBF7D0"},
+    "diag":     {"bg":"#F1F5F9","text":"#64748B","border":"#E2E8F0"},
+}
+_IX_CELL_STYLE = _CfgTable({sv: f'background:{mc["bg"]};border-color:{mc["border"]};color:{mc["text"]};'
+                            for sv, mc in IX_CELL_CFG.items()}, fallback="none")
+_IX_DIAG_CELL = f'<div class="ix-cell" style="{_IX_CELL_STYLE["diag"]}">—</div>'
+_IX_ROW_HEAD  = '<div class="ix-head" style="justify-content:flex-end;padding-right:4px;">{}</div>'
+
+def _ix_cell(sv):
+    return f'<div class="ix-cell" style="{_IX_CELL_STYLE[sv]}">{sv.upper() if sv != "none" else "OK"}</div>'
+
+_IX_CELL_HTML = {sv: _ix_cell(sv) for sv in IX_CELL_CFG if sv != "diag"}
 
 
 def render_ix_matrix(outputs, ix):
@@ -852,35 +986,19 @@ def render_ix_matrix(outputs, ix):
         return
     drugs = [o["drug"] for o in outputs]
     n     = len(drugs)
+    # Interactions are symmetric: one key per pair, drug names in sorted order
     sm    = {}
     for x in ix.get("all_interactions", []):
         inv = x.get("drugs_involved", [])
         if len(inv) == 2:
-            sv = x.get("severity", "none")
-            sm[(inv[0], inv[1])] = sm[(inv[1], inv[0])] = sv
-    MC = {
-        "critical": {"bg":"#FEF2F2","text":"#7F1D1D","border":"#FECACA"},
-        "high":     {"bg":"#FEF2F2","text":"#7F1D1D","border":"#FECACA"},
-        "moderate": {"bg":"#FFFBEB","text":"#78350F","border":"#FDE68A"},
-        "low":      {"bg":"#FEFCE8","text":"#713F12","border":"#FDE047"},
-        "none":     {"bg":"#F0FDF4","text":"#14532D","border":"#BBF7D0"},
-        "diag":     {"bg":"#F1F5F9","text":"#64748B","border":"#E2E8F0"},
-    }
-    hdrs = '<div class="ix-head"></div>'
-    for d in drugs:
-        hdrs += f'<div class="ix-head">{d[:6]}</div>'
-    grid = ""
-    for i, d1 in enumerate(drugs):
-        grid += f'<div class="ix-head" style="justify-content:flex-end;padding-right:4px;">{d1[:6]}</div>'
-        for j, d2 in enumerate(drugs):
-            if i == j:
-                mc = MC["diag"]
-                grid += f'<div class="ix-cell" style="background:{mc["bg"]};border-color:{mc["border"]};color:{mc["text"]};">—</div>'
-            else:
-                sv = sm.get((d1, d2), "none")
-                mc = MC.get(sv, MC["none"])
-                lbl = sv.upper() if sv != "none" else "OK"
-                grid += f'<div class="ix-cell" style="background:{mc["bg"]};border-color:{mc["border"]};color:{mc["text"]};">{lbl}</div>'
+            a, b = inv
+            sm[(a, b) if a < b else (b, a)] = x.get("severity", "none")
+    hdrs = '<div class="ix-head"></div>' + "".join(f'<div class="ix-head">{d[:6]}</div>' for d in drugs)
+    cell = lambda sv: _IX_CELL_HTML.get(sv) or _ix_cell(sv)
+    grid = "".join(_IX_ROW_HEAD.format(d1[:6])
+                   + "".join(_IX_DIAG_CELL if i == j else cell(sm.get((d1, d2) if d1 < d2 else (d2, d1), "none"))
+                             for j, d2 in enumerate(drugs))
+                   for i, d1 in enumerate(drugs))
     sec("Drug Interaction Matrix")
     st.markdown(f"""
     <div style="background:#FFFFFF;border:1px solid #E8EDF5;border-radius:var(--r-xl);padding:var(--sp-5);margin-bottom:var(--sp-4);box-shadow:var(--shadow-sm);">
@@ -924,17 +1042,21 @@ def render_narrative(outputs, parsed, pid, key, skip_llm):
     </div>""", unsafe_allow_html=True)
 
 
-def render_before_after(outputs):
-    bad = [o for o in outputs if o["risk_assessment"]["risk_label"] in ("Toxic", "Ineffective")]
+BAD_RISK_LABELS = frozenset(("Toxic", "Ineffective"))
+
+
+def render_before_after(bad):
+    """Before/after comparison for the first Toxic / Ineffective output (pre-filtered by the caller)."""
     if not bad:
         return
     o    = bad[0]
+    ra, pg, cr = o["risk_assessment"], o["pharmacogenomic_profile"], o["clinical_recommendation"]
     drug = o["drug"]
-    rl   = o["risk_assessment"]["risk_label"]
-    alts = o["clinical_recommendation"].get("alternative_drugs", [])
+    rl   = ra["risk_label"]
+    alts = cr.get("alternative_drugs", [])
     alt  = alts[0] if alts else "Alternative medication"
-    gene = o["pharmacogenomic_profile"]["primary_gene"]
-    ph   = o["pharmacogenomic_profile"]["phenotype"]
+    gene = pg["primary_gene"]
+    ph   = pg["phenotype"]
     BEFORE = {
         "Toxic":      f"Standard {drug.lower()} dose → toxic accumulation → serious harm",
         "Ineffective": f"Standard {drug.lower()} dose → zero therapeutic effect → treatment failure",
@@ -957,7 +1079,9 @@ def render_before_after(outputs):
     </div>""", unsafe_allow_html=True)
 
 
+@st.fragment
 def render_rx_checker(outputs):
+    # Fragment: picking a drug / pressing Check reruns only this panel, not the whole results page
     sec("Prescription Safety Checker")
     rmap  = {o["drug"]: o for o in outputs}
     drugs = [o["drug"] for o in outputs]
@@ -970,13 +1094,14 @@ def render_rx_checker(outputs):
         check = st.button("Check Safety →", key="rx_check")
     if check and sel in rmap:
         o    = rmap[sel]
-        rl   = o["risk_assessment"]["risk_label"]
-        sev  = o["risk_assessment"]["severity"]
-        rec  = o["clinical_recommendation"]["dosing_recommendation"]
-        gene = o["pharmacogenomic_profile"]["primary_gene"]
-        ph   = o["pharmacogenomic_profile"]["phenotype"]
-        rc   = RISK_CFG.get(rl, RISK_CFG["Unknown"])
-        sp   = SEV_CFG.get(sev, SEV_CFG["none"])
+        ra, pg, cr = o["risk_assessment"], o["pharmacogenomic_profile"], o["clinical_recommendation"]
+        rl   = ra["risk_label"]
+        sev  = ra["severity"]
+        rec  = cr["dosing_recommendation"]
+        gene = pg["primary_gene"]
+        ph   = pg["phenotype"]
+        rc   = RISK_CFG[rl]
+        sp   = SEV_CFG[sev]
         VERDICT = {
             "Safe":         "✓ Safe to Prescribe",
             "Adjust Dosage":"△ Prescribe with Dose Adjustment",
@@ -987,7 +1112,7 @@ def render_rx_checker(outputs):
         <div class="rx-result" style="background:{rc['bg']};border-color:{rc['border']};">
           <div class="rx-verdict" style="color:{rc['text']};">{VERDICT.get(rl, rl)}</div>
           <div class="rx-detail">{gene} {ph} phenotype detected. {rec}</div>
-          <div class="rx-meta" style="color:{sp['text']};">Severity: {sp['label']} · Confidence: {o["risk_assessment"]["confidence_score"]:.0%} · CPIC Level A</div>
+          <div class="rx-meta" style="color:{sp['text']};">Severity: {sp['label']} · Confidence: {ra["confidence_score"]:.0%} · CPIC Level A</div>
         </div>""", unsafe_allow_html=True)
     elif not check:
         st.markdown("""<div class="info-strip"><span>🔍</span>
@@ -995,17 +1120,19 @@ def render_rx_checker(outputs):
         </div>""", unsafe_allow_html=True)
 
 
+_NOTE_PROFILE = itemgetter("primary_gene", "diplotype", "phenotype")
+
+
 def render_clinical_note(outputs, pid):
     lines = [f"SurakshaRx Clinical Note — Patient {pid} — {datetime.utcnow().strftime('%Y-%m-%d')}",
              "=" * 60, ""]
     for o in outputs:
-        gene = o["pharmacogenomic_profile"]["primary_gene"]
-        dip  = o["pharmacogenomic_profile"]["diplotype"]
-        ph   = o["pharmacogenomic_profile"]["phenotype"]
+        gene, dip, ph = _NOTE_PROFILE(o["pharmacogenomic_profile"])
+        cr   = o["clinical_recommendation"]
         drug = o["drug"]
         rl   = o["risk_assessment"]["risk_label"]
-        rec  = o["clinical_recommendation"]["dosing_recommendation"]
-        alts = o["clinical_recommendation"].get("alternative_drugs", [])
+        rec  = cr["dosing_recommendation"]
+        alts = cr.get("alternative_drugs", [])
         lines.append(f"DRUG: {drug}")
         lines.append(f"Gene: {gene} | Diplotype: {dip} | Phenotype: {ph} | Risk: {rl}")
         lines.append(f"CPIC: {rec}")
@@ -1022,61 +1149,224 @@ def render_clinical_note(outputs, pid):
         file_name=f"clinical_note_{pid}.txt", mime="text/plain", key=f"note_{pid}")
 
 
-def render_patient_mode(outputs):
-    bad = any(o["risk_assessment"]["risk_label"] in ("Toxic","Ineffective") for o in outputs)
-    if bad:
-        st.markdown("""<div class="patient-banner" style="background:#FFF1F2;border-color:#FECACA;">
+PATIENT_VERDICT = {
+    "Safe":         "✓ This medicine is likely safe for you",
+    "Adjust Dosage":"△ You may need a different dose",
+    "Toxic":        "⛔ This medicine could be harmful to you",
+    "Ineffective":  "◆ This medicine likely won't work for you",
+}
+
+_PCARD_ACTION_TMPL = '<div class="pcard-action"><span style="font-size:1rem;">{icon}</span><div class="pcard-action-text"><strong>{head}</strong><br>{body}</div></div>'
+
+def _talk_to_doctor(drug, alts):
+    alt_text = f"They may suggest: <strong>{', '.join(alts[:3])}</strong>" if alts else "Ask about alternative medications."
+    return _PCARD_ACTION_TMPL.format(icon="💊", head=f"Talk to your doctor before taking {drug.title()}.", body=alt_text)
+
+def _tell_doctor(drug, alts):
+    return _PCARD_ACTION_TMPL.format(icon="📋", head=f"Tell your doctor about this result before starting {drug.title()}.",
+                                     body="You may need a different dose than usually prescribed.")
+
+# Risk label → builder for the card's call-to-action; Safe / Unknown cards have none
+PCARD_ACTIONS = {"Toxic": _talk_to_doctor, "Ineffective": _talk_to_doctor, "Adjust Dosage": _tell_doctor}
+
+PATIENT_BANNER_BAD = """<div class="patient-banner" style="background:#FFF1F2;border-color:#FECACA;">
           <div class="patient-banner-title" style="color:#B91C1C;">🚨 Important — Some medications need urgent attention</div>
           <div class="patient-banner-sub" style="color:#7F1D1D;">Your genetic results show that one or more medications may not be safe or effective for you. Please speak with your doctor before taking these medications.</div>
-        </div>""", unsafe_allow_html=True)
-    else:
-        st.markdown("""<div class="patient-banner" style="background:#F0FDF4;border-color:#BBF7D0;">
+        </div>"""
+PATIENT_BANNER_OK = """<div class="patient-banner" style="background:#F0FDF4;border-color:#BBF7D0;">
           <div class="patient-banner-title" style="color:#14532D;">✓ Good news — Your medications look safe</div>
           <div class="patient-banner-sub" style="color:#16A34A;">Based on your genetic profile, the medications reviewed are predicted to work normally at standard doses.</div>
-        </div>""", unsafe_allow_html=True)
-    for o in outputs:
-        drug    = o["drug"]
-        rl      = o["risk_assessment"]["risk_label"]
-        gene    = o["pharmacogenomic_profile"]["primary_gene"]
-        ph      = o["pharmacogenomic_profile"]["phenotype"]
-        alts    = o["clinical_recommendation"].get("alternative_drugs", [])
-        phplain = PLAIN_PHENO.get(ph, ph)
-        explain = PLAIN_RISK.get((drug, ph), "")
-        VERDICT = {
-            "Safe":         "✓ This medicine is likely safe for you",
-            "Adjust Dosage":"△ You may need a different dose",
-            "Toxic":        "⛔ This medicine could be harmful to you",
-            "Ineffective":  "◆ This medicine likely won't work for you",
-        }
-        rc = RISK_CFG.get(rl, RISK_CFG["Unknown"])
-        action = ""
-        if rl in ("Toxic", "Ineffective"):
-            alt_text = f"They may suggest: <strong>{', '.join(alts[:3])}</strong>" if alts else "Ask about alternative medications."
-            action = f'<div class="pcard-action"><span style="font-size:1rem;">💊</span><div class="pcard-action-text"><strong>Talk to your doctor before taking {drug.title()}.</strong><br>{alt_text}</div></div>'
-        elif rl == "Adjust Dosage":
-            action = f'<div class="pcard-action"><span style="font-size:1rem;">📋</span><div class="pcard-action-text"><strong>Tell your doctor about this result before starting {drug.title()}.</strong><br>You may need a different dose than usually prescribed.</div></div>'
-        st.markdown(f"""
-        <div class="pcard" style="border-color:{rc['border']};">
-          <div class="pcard-drug">{drug.title()}</div>
-          <div class="pcard-verdict" style="color:{rc['text']};">{VERDICT.get(rl, rl)}</div>
-          <div class="pcard-gene">{gene} · {phplain}</div>
-          {f'<div class="pcard-plain">{explain}</div>' if explain else ''}
-          {action}
-        </div>""", unsafe_allow_html=True)
+        </div>"""
+
+
+def _pcard(o):
+    drug = o["drug"]
+    rl   = o["risk_assessment"]["risk_label"]
+    pg   = o["pharmacogenomic_profile"]
+    gene, ph = pg["primary_gene"], pg["phenotype"]
+    rc   = RISK_CFG[rl]
+    explain = PLAIN_RISK.get((drug, ph))
+    act  = PCARD_ACTIONS.get(rl)
+    return (f'<div class="pcard" style="border-color:{rc["border"]};">'
+            f'<div class="pcard-drug">{drug.title()}</div>'
+            f'<div class="pcard-verdict" style="color:{rc["text"]};">{PATIENT_VERDICT.get(rl, rl)}</div>'
+            f'<div class="pcard-gene">{gene} · {PLAIN_PHENO.get(ph, ph)}</div>'
+            + (f'<div class="pcard-plain">{explain}</div>' if explain else '')
+            + (act(drug, o["clinical_recommendation"].get("alternative_drugs", [])) if act else '')
+            + '</div>')
+
+
+def patient_mode_html(outputs, bad):
+    return (PATIENT_BANNER_BAD if bad else PATIENT_BANNER_OK, *map(_pcard, outputs))
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 # MASTER RESULTS RENDERER
 # ══════════════════════════════════════════════════════════════════════════════
 
-def render_results(outputs, parsed, ix, pdf_bytes, pid, patient_mode=False, key="", skip_llm=False):
-    render_disclaimer()
-    render_risk_center(outputs, parsed)
-    render_critical_alerts(outputs)
+def drug_card_html(output):
+    """Full markup for one drug card (header through AI explanation, closing tags included)."""
+    ra, pg, cr = output["risk_assessment"], output["pharmacogenomic_profile"], output["clinical_recommendation"]
+    rl   = ra["risk_label"]
+    drug = output["drug"]
+    sev  = ra["severity"]
+    conf = ra["confidence_score"]
+    gene = pg["primary_gene"]
+    dip  = pg["diplotype"]
+    ph   = pg["phenotype"]
+    var  = pg["detected_variants"]
+    rec  = cr["dosing_recommendation"]
+    alts = cr.get("alternative_drugs", [])
+    mon  = cr.get("monitoring_required", "")
+    exp  = output["llm_generated_explanation"]
+    rc   = RISK_CFG[rl]
+    sp   = SEV_CFG[sev]
+    cpic_lv = output.get("pharmacogenomic_profile", {}).get("cpic_evidence_level", "Level A")
+    card = []
+
+    card.append(f"""
+    <div class="dcard reveal-card">
+      <div class="dcard-header">
+        <div class="dcard-left">
+          <div class="dcard-indicator" style="background:{rc['severity_dot']};box-shadow:0 0 0 3px {rc['bg']};"></div>
+          <div>
+            <div class="dcard-drug">{drug.title()}
+              <span class="cpic-badge">CPIC {cpic_lv}</span>
+            </div>
+            <div class="dcard-meta">{gene} · {dip} · {ph}</div>
+          </div>
+        </div>
+        {risk_badge_html(rl)}
+      </div>
+      <div class="dcard-body">
+        <div class="metrics-row">
+          <div class="metric-cell"><div class="metric-key">Phenotype</div><div class="metric-val" style="color:{rc['text']};font-size:.95rem;">{ph}</div></div>
+          <div class="metric-cell"><div class="metric-key">Severity</div><div class="metric-val" style="color:{sp['text']};font-size:.95rem;">{sp['label']}</div></div>
+          <div class="metric-cell"><div class="metric-key">Confidence</div><div class="metric-val">{conf:.0%}</div></div>
+          <div class="metric-cell"><div class="metric-key">Variants</div><div class="metric-val">{len(var)}</div></div>
+        </div>""")
+
+    dq = min(1.0, len(var) / 3.0)
+    card.append(f"""
+    <div class="conf-grid">
+      <div>
+        <div class="conf-label"><span>Prediction Confidence</span><span style="color:{rc['severity_dot']};font-weight:700;">{conf:.0%}</span></div>
+        <div class="conf-track"><div class="conf-fill" style="width:{conf*100:.1f}%;background:{rc['severity_dot']};"></div></div>
+      </div>
+      <div>
+        <div class="conf-label"><span>Data Quality</span><span style="color:#64748B;">{len(var)} variant{"s" if len(var)!=1 else ""}</span></div>
+        <div class="conf-track"><div class="conf-fill" style="width:{dq*100:.1f}%;background:#94A3B8;"></div></div>
+      </div>
+    </div>""")
+
+    if var:
+        rows_html = []
+        for v in var:
+            fc, fn = variant_status(v.get("functional_status"))
+            rows_html.append(f'<tr><td class="v-rsid">{v.get("rsid","—")}</td>'
+                             f'<td class="v-star">{v.get("star_allele","—")}</td>'
+                             f'<td class="{fc}">{fn}</td></tr>')
+        card.append(f"""
+        <div style="margin-bottom:var(--sp-4);">
+          <div class="conf-label" style="margin-bottom:var(--sp-3);">Detected Variants ({len(var)})</div>
+          <table class="vtable">
+            <thead><tr><th>rsID</th><th>Star Allele</th><th>Functional Status</th></tr></thead>
+            <tbody>{"".join(rows_html)}</tbody>
+          </table>
+        </div>""")
+
+    card.append(f"""
+    <div class="rec-box" style="background:{rc['bg']};border-color:{rc['border']};">
+      <div class="rec-label" style="color:{rc['text']};">CPIC Recommendation — {drug}</div>
+      <div class="rec-text">{rec}</div>
+    </div>""")
+
+    if mon:
+        card.append(f"""
+        <div class="rec-box" style="background:#F1F5F9;border-color:#E8EDF5;">
+          <div class="rec-label" style="color:#64748B;">🔬 Monitoring Protocol</div>
+          <div class="rec-text">{mon}</div>
+        </div>""")
+
+    if alts:
+        chips = "".join(f'<span class="alt-chip">{a}</span>' for a in alts)
+        card.append(f"""
+        <div style="margin-bottom:var(--sp-4);">
+          <div class="conf-label" style="margin-bottom:var(--sp-2);">Alternative Medications</div>
+          <div class="alt-chips">{chips}</div>
+        </div>""")
+
+    card.append(pop_freq_html(gene, ph))
+
+    if exp.get("summary"):
+        raw_model = exp.get("model_used", "llama-3.3-70b")
+        model, is_static = clean_model_label(raw_model)
+        blocks = []
+        for lbl, k in [("Summary","summary"), ("Biological Mechanism","biological_mechanism"),
+                       ("Variant Significance","variant_significance"), ("Clinical Implications","clinical_implications")]:
+            if exp.get(k):
+                blocks.append(f'<div class="ai-section">'
+                              f'<div class="ai-sec-label">{lbl}</div>'
+                              f'<div class="ai-sec-text">{exp[k]}</div>'
+                              f'</div>')
+        card.append(f"""
+        <div class="ai-block">
+          <div class="ai-header">
+            <span class="ai-badge-pill">{model}</span>
+            <span class="ai-title">AI Explanation · {drug}</span>
+          </div>{"".join(blocks)}
+        </div>""")
+
+    card.append('</div></div>')
+    return "".join(p.strip() for p in card if p)
+
+
+def _render_blocks(outputs, parsed, ix, patient_mode, any_bad):
+    """Every widget-free HTML section and download payload of the results view, built in one go for the render cache."""
+    critical = [o for o in outputs if o["risk_assessment"]["severity"] == "critical"]
+    blocks = {"head": (DISCLAIMER_HTML, risk_center_html(outputs, parsed),
+                       critical_alerts_html(critical) if critical else ""),
+              "outputs_json": to_json_bytes(outputs),
+              "ix_json": to_json_bytes(ix) if ix and ix.get("interactions_found") else None}
+    if patient_mode:
+        blocks["patient"] = patient_mode_html(outputs, any_bad)
+        return blocks
+    table, csv_data = drug_table_html(outputs)
+    blocks.update(overview=(gene_row_html(outputs), table), csv=csv_data, pgx=pgx_html(outputs),
+                  heatmap=heatmap_html(outputs), chrom=chromosome_html(outputs, parsed),
+                  cards=[drug_card_html(o) for o in outputs])
+    return blocks
+
+
+def results_digest(outputs, parsed, ix, pid):
+    """Fingerprint of one pipeline run — computed once when the results are stored, not per rerun."""
+    return hashlib.blake2b(json.dumps([outputs, parsed.get("detected_genes"), parsed.get("total_variants"),
+                                       ix, pid], sort_keys=True, default=str).encode(),
+                           digest_size=16).hexdigest()
+
+
+def _cached_blocks(digest, outputs, parsed, ix, patient_mode, any_bad):
+    """Rendered sections from st.session_state when the same results were already drawn in this mode."""
+    cache = st.session_state.setdefault("_render_cache", {})
+    h = (digest, patient_mode)
+    blocks = cache.get(h)
+    if blocks is None:
+        if len(cache) >= 8:
+            cache.clear()
+        blocks = cache[h] = _render_blocks(outputs, parsed, ix, patient_mode, any_bad)
+    return blocks
+
+
+def render_results(outputs, parsed, ix, pdf_bytes, pid, patient_mode=False, key="", skip_llm=False, digest=None):
+    bad_outputs = [o for o in outputs if o["risk_assessment"]["risk_label"] in BAD_RISK_LABELS]
+    if digest is None:
+        digest = results_digest(outputs, parsed, ix, pid)
+    blocks = _cached_blocks(digest, outputs, parsed, ix, patient_mode, bool(bad_outputs))
+    emit_html(*blocks["head"])
 
     dc1, dc2, dc3 = st.columns(3)
     with dc1:
-        st.download_button("⬇ Download All JSON", data=json.dumps(outputs, indent=2),
+        st.download_button("⬇ Download All JSON", data=blocks["outputs_json"],
             file_name=f"SurakshaRx_{pid}.json", mime="application/json",
             use_container_width=True, key=f"dlall_{pid}")
     with dc2:
@@ -1085,150 +1375,39 @@ def render_results(outputs, parsed, ix, pdf_bytes, pid, patient_mode=False, key=
                 file_name=f"SurakshaRx_{pid}.pdf", mime="application/pdf",
                 use_container_width=True, key=f"dlpdf_{pid}")
     with dc3:
-        if ix and ix.get("interactions_found"):
-            st.download_button("⬇ Interactions JSON", data=json.dumps(ix, indent=2),
+        if blocks["ix_json"]:
+            st.download_button("⬇ Interactions JSON", data=blocks["ix_json"],
                 file_name=f"SurakshaRx_{pid}_ix.json", mime="application/json",
                 use_container_width=True, key=f"dlix_{pid}")
 
     st.markdown("<div style='height:var(--sp-3)'></div>", unsafe_allow_html=True)
 
     if patient_mode:
-        render_patient_mode(outputs)
+        emit_html(*blocks["patient"])
         return
 
-    render_gene_row(outputs)
-    render_drug_table(outputs, pid)
-    render_pgx(outputs)
+    emit_html(*blocks["overview"])
+    render_csv_download(blocks["csv"], pid)
+    emit_html(blocks["pgx"])
 
     c1, c2 = st.columns([1.4, 1], gap="large")
-    with c1: render_heatmap(outputs)
-    with c2: render_chromosome(outputs, parsed)
+    with c1: emit_html(blocks["heatmap"])
+    with c2: emit_html(blocks["chrom"])
 
     if ix and len(outputs) >= 2:
         render_ix_matrix(outputs, ix)
 
     render_narrative(outputs, parsed, pid, key, skip_llm)
-    render_before_after(outputs)
+    render_before_after(bad_outputs)
     render_rx_checker(outputs)
     render_clinical_note(outputs, pid)
 
     sec("Individual Drug Analysis")
-    for output in outputs:
-        rl   = output["risk_assessment"]["risk_label"]
-        drug = output["drug"]
-        sev  = output["risk_assessment"]["severity"]
-        conf = output["risk_assessment"]["confidence_score"]
-        gene = output["pharmacogenomic_profile"]["primary_gene"]
-        dip  = output["pharmacogenomic_profile"]["diplotype"]
-        ph   = output["pharmacogenomic_profile"]["phenotype"]
-        var  = output["pharmacogenomic_profile"]["detected_variants"]
-        rec  = output["clinical_recommendation"]["dosing_recommendation"]
-        alts = output["clinical_recommendation"].get("alternative_drugs", [])
-        mon  = output["clinical_recommendation"].get("monitoring_required", "")
-        exp  = output["llm_generated_explanation"]
-        rc   = RISK_CFG.get(rl, RISK_CFG["Unknown"])
-        sp   = SEV_CFG.get(sev, SEV_CFG["none"])
-        cpic_lv = output.get("pharmacogenomic_profile", {}).get("cpic_evidence_level", "Level A")
-
-        st.markdown(f"""
-        <div class="dcard reveal-card">
-          <div class="dcard-header">
-            <div class="dcard-left">
-              <div class="dcard-indicator" style="background:{rc['severity_dot']};box-shadow:0 0 0 3px {rc['bg']};"></div>
-              <div>
-                <div class="dcard-drug">{drug.title()}
-                  <span class="cpic-badge">CPIC {cpic_lv}</span>
-                </div>
-                <div class="dcard-meta">{gene} · {dip} · {ph}</div>
-              </div>
-            </div>
-            {risk_badge_html(rl)}
-          </div>
-          <div class="dcard-body">
-            <div class="metrics-row">
-              <div class="metric-cell"><div class="metric-key">Phenotype</div><div class="metric-val" style="color:{rc['text']};font-size:.95rem;">{ph}</div></div>
-              <div class="metric-cell"><div class="metric-key">Severity</div><div class="metric-val" style="color:{sp['text']};font-size:.95rem;">{sp['label']}</div></div>
-              <div class="metric-cell"><div class="metric-key">Confidence</div><div class="metric-val">{conf:.0%}</div></div>
-              <div class="metric-cell"><div class="metric-key">Variants</div><div class="metric-val">{len(var)}</div></div>
-            </div>""", unsafe_allow_html=True)
-
-        dq = min(1.0, len(var) / 3.0)
-        st.markdown(f"""
-        <div class="conf-grid">
-          <div>
-            <div class="conf-label"><span>Prediction Confidence</span><span style="color:{rc['severity_dot']};font-weight:700;">{conf:.0%}</span></div>
-            <div class="conf-track"><div class="conf-fill" style="width:{conf*100:.1f}%;background:{rc['severity_dot']};"></div></div>
-          </div>
-          <div>
-            <div class="conf-label"><span>Data Quality</span><span style="color:#64748B;">{len(var)} variant{"s" if len(var)!=1 else ""}</span></div>
-            <div class="conf-track"><div class="conf-fill" style="width:{dq*100:.1f}%;background:#94A3B8;"></div></div>
-          </div>
-        </div>""", unsafe_allow_html=True)
-
-        if var:
-            rows_html = ""
-            for v in var:
-                fc = func_cls(v.get("functional_status", ""))
-                fn = (v.get("functional_status") or "unknown").replace("_", " ").title()
-                rows_html += (f'<tr><td class="v-rsid">{v.get("rsid","—")}</td>'
-                              f'<td class="v-star">{v.get("star_allele","—")}</td>'
-                              f'<td class="{fc}">{fn}</td></tr>')
-            st.markdown(f"""
-            <div style="margin-bottom:var(--sp-4);">
-              <div class="conf-label" style="margin-bottom:var(--sp-3);">Detected Variants ({len(var)})</div>
-              <table class="vtable">
-                <thead><tr><th>rsID</th><th>Star Allele</th><th>Functional Status</th></tr></thead>
-                <tbody>{rows_html}</tbody>
-              </table>
-            </div>""", unsafe_allow_html=True)
-
-        st.markdown(f"""
-        <div class="rec-box" style="background:{rc['bg']};border-color:{rc['border']};">
-          <div class="rec-label" style="color:{rc['text']};">CPIC Recommendation — {drug}</div>
-          <div class="rec-text">{rec}</div>
-        </div>""", unsafe_allow_html=True)
-
-        if mon:
-            st.markdown(f"""
-            <div class="rec-box" style="background:#F1F5F9;border-color:#E8EDF5;">
-              <div class="rec-label" style="color:#64748B;">🔬 Monitoring Protocol</div>
-              <div class="rec-text">{mon}</div>
-            </div>""", unsafe_allow_html=True)
-
-        if alts:
-            chips = "".join(f'<span class="alt-chip">{a}</span>' for a in alts)
-            st.markdown(f"""
-            <div style="margin-bottom:var(--sp-4);">
-              <div class="conf-label" style="margin-bottom:var(--sp-2);">Alternative Medications</div>
-              <div class="alt-chips">{chips}</div>
-            </div>""", unsafe_allow_html=True)
-
-        render_pop_freq(gene, ph)
-
-        if exp.get("summary"):
-            raw_model = exp.get("model_used", "llama-3.3-70b")
-            model, is_static = clean_model_label(raw_model)
-            blocks = ""
-            for lbl, k in [("Summary","summary"), ("Biological Mechanism","biological_mechanism"),
-                           ("Variant Significance","variant_significance"), ("Clinical Implications","clinical_implications")]:
-                if exp.get(k):
-                    blocks += (f'<div class="ai-section">'
-                               f'<div class="ai-sec-label">{lbl}</div>'
-                               f'<div class="ai-sec-text">{exp[k]}</div>'
-                               f'</div>')
-            st.markdown(f"""
-            <div class="ai-block">
-              <div class="ai-header">
-                <span class="ai-badge-pill">{model}</span>
-                <span class="ai-title">AI Explanation · {drug}</span>
-              </div>{blocks}
-            </div>""", unsafe_allow_html=True)
-
-        with st.expander(f"Raw JSON — {drug}"):
+    for output, card in zip(outputs, blocks["cards"]):
+        emit_html(card)
+        with st.expander(f"Raw JSON — {output['drug']}"):
             st.json(output)
 
-        st.markdown('</div></div>', unsafe_allow_html=True)
-
 
 # ══════════════════════════════════════════════════════════════════════════════
 # NAVIGATION + LAYOUT
@@ -1267,53 +1446,43 @@ def render_steps(has_vcf, has_drugs, has_results):
         ("03", "Run Analysis", has_results),
         ("04", "Review Results", has_results),
     ]
-    html = '<div class="steps">'
-    for num, lbl, done in steps:
-        cls = "step done" if done else "step"
-        html += f'<div class="{cls}"><div class="step-num">{num}</div><div class="step-lbl">{lbl}</div></div>'
-    html += "</div>"
-    st.markdown(html, unsafe_allow_html=True)
-
-
-def render_persona_demo(key):
-    SEV_COLORS = {
-        "critical": {"sev_bg":"#FEF2F2","sev_border":"#FECACA","sev_text":"#7F1D1D","sev_label":"Critical"},
-        "high":     {"sev_bg":"#FFF7ED","sev_border":"#FED7AA","sev_text":"#7C2D12","sev_label":"High Risk"},
-        "moderate": {"sev_bg":"#FFFBEB","sev_border":"#FDE68A","sev_text":"#78350F","sev_label":"Moderate"},
-        "none":     {"sev_bg":"#F0FDF4","sev_border":"#BBF7D0","sev_text":"#14532D","sev_label":"All Safe"},
-    }
-    st.markdown('<div style="font-size:.8rem;font-weight:600;letter-spacing:.1em;text-transform:uppercase;color:#64748B;margin-bottom:var(--sp-3);">Quick Demo — Select Patient Persona</div>', unsafe_allow_html=True)
-    cols = st.columns(4)
-    for i, (pid, p) in enumerate(PERSONAS.items()):
-        sc = SEV_COLORS.get(p["sev"], SEV_COLORS["none"])
-        with cols[i]:
-            st.markdown(f"""
-            <div class="persona-card">
-              <div class="pc-sev" style="background:{sc['sev_bg']};border-color:{sc['sev_border']};color:{sc['sev_text']};">
-                {sc['sev_label']}
-              </div>
-              <div class="pc-name">{p['label']}</div>
-              <div class="pc-desc">{p['desc']}</div>
-            </div>""", unsafe_allow_html=True)
-            if st.button(f"Load {p['label']}", key=f"persona_{pid}", use_container_width=True):
-                # FIX: try/except fallback if sample_data files are missing
-                try:
-                    vcf = load_vcf(p["file"])
-                except FileNotFoundError:
-                    vcf = get_sample_vcf()
-                    st.warning(f"Sample file '{p['file']}' not found — using default VCF for demo.")
-                pid_gen = f"PG-{uuid.uuid4().hex[:8].upper()}"
-                with st.spinner(f"Running {p['label']} analysis…"):
-                    parsed, results, outputs, ix, pdf = run_pipeline(
-                        vcf, p["drugs"], pid_gen, key, skip_llm=not bool(key))
-                st.session_state["results"]      = outputs
-                st.session_state["parsed"]       = parsed
-                st.session_state["ix"]           = ix
-                st.session_state["pdf"]          = pdf
-                st.session_state["patient_id"]   = pid_gen
-                st.session_state["results_key"]  = key
-                st.session_state["results_skip"] = not bool(key)
-                st.rerun()
+    html = "".join(f'<div class="{"step done" if done else "step"}"><div class="step-num">{num}</div>'
+                   f'<div class="step-lbl">{lbl}</div></div>' for num, lbl, done in steps)
+    st.markdown(f'<div class="steps">{html}</div>', unsafe_allow_html=True)
+
+
+PERSONA_CARD_COLORS = {
+    "critical": ("#FEF2F2","#FECACA","#7F1D1D"),
+    "high":     ("#FFF7ED","#FED7AA","#7C2D12"),
+    "moderate": ("#FFFBEB","#FDE68A","#78350F"),
+    "none":     ("#F0FDF4","#BBF7D0","#14532D"),
+}
+
+
+def _persona_card_html(p):
+    """Compact sidebar-style persona card — depends only on the static PERSONAS entry."""
+    bg, border, txt = PERSONA_CARD_COLORS.get(p["sev"], PERSONA_CARD_COLORS["none"])
+    return f'''<div style="background:{bg};border:1.5px solid {border};border-radius:10px;
+                        padding:10px 12px;margin-bottom:8px;">
+                        <div style="font-size:.8rem;font-weight:700;color:{txt};">{p["label"]}</div>
+                        <div style="font-family:monospace;font-size:.65rem;color:{txt};opacity:.75;">{p["desc"]}</div>
+                        </div>'''
+
+PERSONA_CARD_HTML = {persona_id: _persona_card_html(p) for persona_id, p in PERSONAS.items()}
+
+
+_SIDEBAR_GENE_MAP_MD = "**Gene → Drug Map**\n\n" + "\n\n".join(
+    f"`{gene}` → {drug.title()}" for drug, gene in GENE_DRUG_MAP.items())
+
+
+def _tc_status_html(tc_res):
+    color_cls = "tc-status-pass" if tc_res["passed"] else "tc-status-fail"
+    icon = "✓ PASS" if tc_res["passed"] else "✗ FAIL"
+    return (f'<div class="{color_cls}">'
+            f'<strong>{icon} — {tc_res["name"]}</strong><br>'
+            f'<span style="font-size:.78rem;opacity:.85;">{tc_res["detail"]}</span><br>'
+            f'<span style="font-size:.7rem;opacity:.55;">{tc_res["source"]}</span>'
+            f'</div>')
 
 
 def render_test_suite(key):
@@ -1327,18 +1496,8 @@ def render_test_suite(key):
 
     # Show persistent test results from session state
     if "tc_results" in st.session_state:
-        for tc_res in st.session_state["tc_results"]:
-            color_cls = "tc-status-pass" if tc_res["passed"] else "tc-status-fail"
-            icon = "✓ PASS" if tc_res["passed"] else "✗ FAIL"
-            st.markdown(
-                f'<div class="{color_cls}">'
-                f'<strong>{icon} — {tc_res["name"]}</strong><br>'
-                f'<span style="font-size:.78rem;opacity:.85;">{tc_res["detail"]}</span><br>'
-                f'<span style="font-size:.7rem;opacity:.55;">{tc_res["source"]}</span>'
-                f'</div>',
-                unsafe_allow_html=True
-            )
-        st.markdown('<div style="height:8px;"></div>', unsafe_allow_html=True)
+        st.markdown("\n".join(_tc_status_html(tc_res) for tc_res in st.session_state["tc_results"])
+                    + '<div style="height:8px;"></div>', unsafe_allow_html=True)
         if st.button("Clear results", key="tc_clear"):
             del st.session_state["tc_results"]
             st.rerun()
@@ -1346,11 +1505,7 @@ def render_test_suite(key):
 
     for i, tc in enumerate(TEST_SUITE):
         with st.container():
-            st.markdown(f"""
-            <div class="tc-card">
-              <span class="tc-name">{tc['name']}</span>
-              <span class="tc-desc">{tc['desc']}</span>
-            </div>""", unsafe_allow_html=True)
+            st.markdown(TC_CARD_TMPL.format(name=tc["name"], desc=tc["desc"]), unsafe_allow_html=True)
 
             if st.button(f"▶ Run: {tc['name']}", key=f"tc_{i}", use_container_width=True):
                 try:
@@ -1363,8 +1518,9 @@ def render_test_suite(key):
                 pid = f"TC-{uuid.uuid4().hex[:6].upper()}"
                 with st.spinner(f"Running {tc['name']}…"):
                     try:
+                        # Static templates only: no key reaches the pipeline, so no LLM path is entered
                         parsed, results, outputs, ix, pdf = run_pipeline(
-                            vcf, tc["drugs"], pid, key, skip_llm=True)
+                            vcf, tc["drugs"], pid, "", skip_llm=True)
 
                         detail_lines = []
                         all_pass = True
@@ -1398,7 +1554,8 @@ def render_test_suite(key):
                         st.session_state["ix"]           = ix
                         st.session_state["pdf"]          = pdf
                         st.session_state["patient_id"]   = pid
-                        st.session_state["results_key"]  = key
+                        st.session_state["results_digest"] = results_digest(outputs, parsed, ix, pid)
+                        st.session_state["results_key"]  = ""
                         st.session_state["results_skip"] = True
                         st.rerun()
 
@@ -1410,7 +1567,33 @@ def render_test_suite(key):
 # MAIN
 # ══════════════════════════════════════════════════════════════════════════════
 
+PID_CHIP_TMPL = """
+                <div style="display:flex;align-items:center;gap:var(--sp-3);margin-bottom:var(--sp-4);">
+                  <span style="font-family:var(--font-mono);font-size:1rem;font-weight:700;
+                    color:#1D4ED8;background:#EFF6FF;border:1px solid #BFDBFE;
+                    padding:4px 12px;border-radius:9999px;">{pid}</span>
+                </div>"""
+
+TC_CARD_TMPL = """
+            <div class="tc-card">
+              <span class="tc-name">{name}</span>
+              <span class="tc-desc">{desc}</span>
+            </div>"""
+
+EMPTY_STATE_HTML = """
+                <div class="empty-state">
+                  <span class="empty-icon">🧬</span>
+                  <div class="empty-title">No analysis results yet</div>
+                  <div class="empty-hint">
+                    Upload a VCF file or select a scenario<br>
+                    Choose medications to analyse<br>
+                    Click Run Analysis →
+                  </div>
+                </div>"""
+
 def main():
+    st.markdown(APP_CSS, unsafe_allow_html=True)
+
     # ── Sidebar ───────────────────────────────────────────────────────────────
     with st.sidebar:
         st.markdown("### ⚙ Settings")
@@ -1420,9 +1603,7 @@ def main():
                         help="Model used for AI explanations")
         use_static = st.checkbox("Test mode: instant (no API call)", value=not bool(groq_key))
         st.markdown("---")
-        st.markdown("**Gene → Drug Map**")
-        for drug, gene in GENE_DRUG_MAP.items():
-            st.markdown(f"`{gene}` → {drug.title()}")
+        st.markdown(_SIDEBAR_GENE_MAP_MD)
 
     key       = groq_key.strip() if groq_key else ""
     skip_llm  = use_static or not key
@@ -1457,18 +1638,16 @@ def main():
                 key="persona_sel",
             )
 
-            # Resolve VCF text
+            # Resolve the chosen scenario once; both the VCF and the default drug list come from it
+            sel_persona = PERSONA_BY_LABEL.get(persona_sel)
             vcf_text = None
             if vcf_file:
                 vcf_text = vcf_file.read().decode("utf-8")
-            elif persona_sel != "None":
-                for p in PERSONAS.values():
-                    if p["label"] == persona_sel:
-                        try:
-                            vcf_text = load_vcf(p["file"])
-                        except FileNotFoundError:
-                            vcf_text = get_sample_vcf()
-                        break
+            elif sel_persona:
+                try:
+                    vcf_text = load_vcf(sel_persona["file"])
+                except FileNotFoundError:
+                    vcf_text = get_sample_vcf()
 
             if vcf_text:
                 fname = getattr(vcf_file, 'name', persona_sel) if vcf_file else persona_sel
@@ -1477,12 +1656,7 @@ def main():
 
             st.markdown('<div style="height:4px;"></div>', unsafe_allow_html=True)
             sec("Medications to Analyse")
-            default_drugs = ALL_DRUGS
-            if persona_sel != "None":
-                for p in PERSONAS.values():
-                    if p["label"] == persona_sel:
-                        default_drugs = p["drugs"]
-                        break
+            default_drugs = sel_persona["drugs"] if sel_persona else ALL_DRUGS
             selected_drugs = st.multiselect("Select drugs", ALL_DRUGS,
                 default=default_drugs, label_visibility="collapsed")
             custom_raw = st.text_input("Custom drugs (comma-separated)", placeholder="CODEINE, WARFARIN…")
@@ -1497,21 +1671,9 @@ def main():
 
             sec("Quick Demo Personas")
             persona_cols = st.columns(2)
-            SEV_COLORS_LOCAL = {
-                "critical": ("#FEF2F2","#FECACA","#7F1D1D"),
-                "high":     ("#FFF7ED","#FED7AA","#7C2D12"),
-                "moderate": ("#FFFBEB","#FDE68A","#78350F"),
-                "none":     ("#F0FDF4","#BBF7D0","#14532D"),
-            }
             for pi, (persona_id, p) in enumerate(PERSONAS.items()):
-                bg, border, txt = SEV_COLORS_LOCAL.get(p["sev"], SEV_COLORS_LOCAL["none"])
                 with persona_cols[pi % 2]:
-                    st.markdown(
-                        f'''<div style="background:{bg};border:1.5px solid {border};border-radius:10px;
-                        padding:10px 12px;margin-bottom:8px;">
-                        <div style="font-size:.8rem;font-weight:700;color:{txt};">{p["label"]}</div>
-                        <div style="font-family:monospace;font-size:.65rem;color:{txt};opacity:.75;">{p["desc"]}</div>
-                        </div>''', unsafe_allow_html=True)
+                    st.markdown(PERSONA_CARD_HTML[persona_id], unsafe_allow_html=True)
                     if st.button(f"Load", key=f"persona2_{persona_id}", use_container_width=True):
                         try:
                             vcf_text = load_vcf(p["file"])
@@ -1526,6 +1688,7 @@ def main():
                         st.session_state["ix"]           = ix
                         st.session_state["pdf"]          = pdf
                         st.session_state["patient_id"]   = pid_gen
+                        st.session_state["results_digest"] = results_digest(outputs, parsed, ix, pid_gen)
                         st.session_state["results_key"]  = key
                         st.session_state["results_skip"] = not bool(key)
                         st.rerun()
@@ -1548,6 +1711,7 @@ def main():
                 st.session_state["ix"]           = ix
                 st.session_state["pdf"]          = pdf
                 st.session_state["patient_id"]   = pid
+                st.session_state["results_digest"] = results_digest(outputs, parsed, ix, pid)
                 st.session_state["results_key"]  = key
                 st.session_state["results_skip"] = skip_llm
                 st.rerun()
@@ -1562,25 +1726,12 @@ def main():
                 res_pdf  = st.session_state.get("pdf")
                 res_key  = st.session_state.get("results_key", key)
                 res_skip = st.session_state.get("results_skip", skip_llm)
-                st.markdown(f"""
-                <div style="display:flex;align-items:center;gap:var(--sp-3);margin-bottom:var(--sp-4);">
-                  <span style="font-family:var(--font-mono);font-size:1rem;font-weight:700;
-                    color:#1D4ED8;background:#EFF6FF;border:1px solid #BFDBFE;
-                    padding:4px 12px;border-radius:9999px;">{res_pid}</span>
-                </div>""", unsafe_allow_html=True)
+                res_dig  = st.session_state.get("results_digest")
+                st.markdown(PID_CHIP_TMPL.format(pid=res_pid), unsafe_allow_html=True)
                 render_results(res_outs, res_par, res_ix, res_pdf, res_pid,
-                               patient_mode=patient_mode, key=res_key, skip_llm=res_skip)
+                               patient_mode=patient_mode, key=res_key, skip_llm=res_skip, digest=res_dig)
             else:
-                st.markdown("""
-                <div class="empty-state">
-                  <span class="empty-icon">🧬</span>
-                  <div class="empty-title">No analysis results yet</div>
-                  <div class="empty-hint">
-                    Upload a VCF file or select a scenario<br>
-                    Choose medications to analyse<br>
-                    Click Run Analysis →
-                  </div>
-                </div>""", unsafe_allow_html=True)
+                st.markdown(EMPTY_STATE_HTML, unsafe_allow_html=True)
 
     # ── Test Suite Tab ────────────────────────────────────────────────────────
     with tab_suite:
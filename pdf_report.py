@@ -22,6 +22,10 @@ SEVERITY_COLORS = {
     "high":     (239, 68,  68),
     "critical": (185, 28,  28),
 }
+GENE_FOUND_FILL   = (6, 95, 70)    # gene-status chip: variants detected
+GENE_WILD_FILL    = (51, 65, 85)   # gene-status chip: wild-type
+VARIANT_ROW_FILLS = ((248, 250, 252), (241, 245, 249))  # alternating variant-table row shading
+FOOTER_DISCLAIMER = "DISCLAIMER: SurakshaRx is a research tool. Not for clinical use without validation. cpicpgx.org"
 
 
 def _safe(text: str) -> str:
@@ -58,6 +62,9 @@ def _safe(text: str) -> str:
 class SurakshaRxPDF(FPDF):
     def __init__(self):
         super().__init__()
+        # One timestamp per report: header() runs on every page, so format it once here
+        self.generated_at = datetime.utcnow()
+        self._gen_stamp   = self.generated_at.strftime('%Y-%m-%d %H:%M UTC')
         self.set_margins(15, 15, 15)
         self.set_auto_page_break(auto=True, margin=20)
 
@@ -71,7 +78,7 @@ class SurakshaRxPDF(FPDF):
         self.set_font("Helvetica", "", 8)
         self.set_text_color(148, 163, 184)
         self.set_xy(10, 14)
-        self.cell(0, 6, f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')} | RIFT 2026 | v5.0", ln=True)
+        self.cell(0, 6, f"Generated: {self._gen_stamp} | RIFT 2026 | v5.0", ln=True)
         self.ln(8)
 
     def footer(self):
@@ -81,7 +88,7 @@ class SurakshaRxPDF(FPDF):
         self.set_text_color(100, 116, 139)
         self.set_font("Helvetica", "I", 7)
         self.set_xy(10, 284)
-        self.cell(0, 6, "DISCLAIMER: SurakshaRx is a research tool. Not for clinical use without validation. cpicpgx.org", ln=False)
+        self.cell(0, 6, FOOTER_DISCLAIMER, ln=False)
         self.set_xy(-30, 284)
         self.cell(0, 6, f"Page {self.page_no()}", align="R")
 
@@ -122,7 +129,7 @@ class SurakshaRxPDF(FPDF):
         self.set_text_color(0, 0, 0)
 
 
-def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Dict) -> bytes:
+def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Dict) -> bytearray:
     pdf = SurakshaRxPDF()
     pdf.add_page()
 
@@ -140,20 +147,20 @@ def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Di
     pdf.cell(60, 7, f"Genes Analyzed: {len(parsed_vcf.get('detected_genes', []))}/6", ln=False)
     pdf.cell(0,  7, f"Drugs Evaluated: {len(all_outputs)}", ln=True)
     pdf.set_x(18)
-    pdf.cell(0,  7, f"Variants Detected: {parsed_vcf.get('total_variants', 0)}  |  Report Date: {datetime.utcnow().strftime('%B %d, %Y')}", ln=True)
+    pdf.cell(0,  7, f"Variants Detected: {parsed_vcf.get('total_variants', 0)}  |  Report Date: {pdf.generated_at.strftime('%B %d, %Y')}", ln=True)
     pdf.ln(6)
 
     # Genomic profile summary
     pdf.section_title("GENOMIC PROFILE SUMMARY", color=(15, 23, 42))
-    genes_found = parsed_vcf.get("detected_genes", [])
+    genes_found = set(parsed_vcf.get("detected_genes", ()))
     all_genes   = ["CYP2D6", "CYP2C19", "CYP2C9", "SLCO1B1", "TPMT", "DPYD"]
     pdf.set_font("Helvetica", "B", 8)
     pdf.set_text_color(100, 116, 139)
     pdf.cell(0, 5, "GENE STATUS OVERVIEW", ln=True)
     pdf.ln(1)
-    for gene in all_genes:
+    for idx, gene in enumerate(all_genes):
         found = gene in genes_found
-        pdf.set_fill_color(6, 95, 70) if found else pdf.set_fill_color(51, 65, 85)
+        pdf.set_fill_color(*(GENE_FOUND_FILL if found else GENE_WILD_FILL))
         pdf.set_text_color(255, 255, 255)
         pdf.set_font("Helvetica", "B", 8)
         pdf.cell(32, 7, f"  {gene}", fill=True, ln=False)
@@ -162,7 +169,7 @@ def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Di
         pdf.set_font("Helvetica", "", 8)
         status = "Variants Detected" if found else "Wild-type (*1/*1)"
         pdf.cell(58, 7, f"  {status}", fill=True, ln=False)
-        if all_genes.index(gene) % 2 == 1:
+        if idx % 2 == 1:
             pdf.ln(8)
         else:
             pdf.set_x(15 + 90)
@@ -172,16 +179,18 @@ def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Di
     for output in all_outputs:
         if pdf.get_y() > 220:
             pdf.add_page()
+        ra, pg, cr = output["risk_assessment"], output["pharmacogenomic_profile"], output["clinical_recommendation"]
         drug       = output["drug"]
-        risk_label = output["risk_assessment"]["risk_label"]
-        severity   = output["risk_assessment"]["severity"]
-        confidence = output["risk_assessment"]["confidence_score"]
-        gene       = output["pharmacogenomic_profile"]["primary_gene"]
-        diplotype  = output["pharmacogenomic_profile"]["diplotype"]
-        phenotype  = output["pharmacogenomic_profile"]["phenotype"]
+        risk_label = ra["risk_label"]
+        severity   = ra["severity"]
+        confidence = ra["confidence_score"]
+        gene       = pg["primary_gene"]
+        diplotype  = pg["diplotype"]
+        phenotype  = pg["phenotype"]
         exp        = output["llm_generated_explanation"]
+        rec        = cr["dosing_recommendation"]
 
-        color = RISK_COLORS.get(risk_label, (31, 41, 55))
+        color = RISK_COLORS.get(risk_label, RISK_COLORS["Unknown"])
         pdf.set_fill_color(*color)
         pdf.set_text_color(255, 255, 255)
         pdf.set_font("Helvetica", "B", 11)
@@ -189,7 +198,6 @@ def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Di
         pdf.ln(2)
 
         if severity in ("high", "critical", "moderate"):
-            rec = output["clinical_recommendation"]["dosing_recommendation"]
             pdf.alert_box(rec, severity)
 
         pdf.set_text_color(15, 23, 42)
@@ -199,7 +207,7 @@ def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Di
         pdf.key_value("Confidence",    f"{confidence:.0%}")
         pdf.ln(2)
 
-        variants = output["pharmacogenomic_profile"]["detected_variants"]
+        variants = pg["detected_variants"]
         if variants:
             pdf.set_font("Helvetica", "B", 8)
             pdf.set_fill_color(30, 41, 59)
@@ -207,10 +215,11 @@ def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Di
             pdf.cell(35, 6, "  rsID",           fill=True)
             pdf.cell(25, 6, "Star Allele",      fill=True)
             pdf.cell(0,  6, "Functional Status", fill=True, ln=True)
+            # Font and text colour are constant for every row (add_page restores them on a break)
+            pdf.set_text_color(15, 23, 42)
+            pdf.set_font("Helvetica", "", 8)
             for j, v in enumerate(variants[:6]):
-                pdf.set_fill_color(248, 250, 252) if j % 2 == 0 else pdf.set_fill_color(241, 245, 249)
-                pdf.set_text_color(15, 23, 42)
-                pdf.set_font("Helvetica", "", 8)
+                pdf.set_fill_color(*VARIANT_ROW_FILLS[j & 1])
                 pdf.cell(35, 5.5, f"  {_safe(v.get('rsid', 'N/A'))}",    fill=True)
                 pdf.cell(25, 5.5, _safe(v.get("star_allele", "N/A")),    fill=True)
                 pdf.cell(0,  5.5, _safe(v.get("functional_status", "Unknown")), fill=True, ln=True)
@@ -242,8 +251,8 @@ def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Di
         pdf.cell(0, 5, "CPIC DOSING RECOMMENDATION", ln=True)
         pdf.set_font("Helvetica", "", 8)
         pdf.set_text_color(15, 23, 42)
-        pdf.multi_cell(0, 4.5, _safe(output["clinical_recommendation"]["dosing_recommendation"]))
-        alts = output["clinical_recommendation"].get("alternative_drugs", [])
+        pdf.multi_cell(0, 4.5, _safe(rec))
+        alts = cr.get("alternative_drugs", [])
         if alts:
             pdf.set_font("Helvetica", "B", 8)
             pdf.set_text_color(71, 85, 105)
@@ -282,4 +291,4 @@ def generate_pdf_report(patient_id: str, all_outputs: List[Dict], parsed_vcf: Di
     ]:
         pdf.cell(0, 6, ref, ln=True)
 
-    return bytes(pdf.output())
\ No newline at end of file
+    return pdf.output()  # fpdf2 already returns a bytearray; callers convert only if they need bytes
\ No newline at end of file
@@ -269,13 +269,10 @@ def run_risk_assessment(parsed_vcf: Dict, drugs: List[str]) -> List[Dict]:
     return results
 
 
-SEVERITY_ORDER = {"none": 0, "low": 1, "moderate": 2, "high": 3, "critical": 4}
+SEVERITY_LEVELS = ("none", "low", "moderate", "high", "critical")
+SEVERITY_ORDER  = {s: i for i, s in enumerate(SEVERITY_LEVELS)}
 
 
 def get_overall_severity(results: List[Dict]) -> str:
-    max_severity = "none"
-    for r in results:
-        s = r.get("severity", "none")
-        if SEVERITY_ORDER.get(s, 0) > SEVERITY_ORDER.get(max_severity, 0):
-            max_severity = s
-    return max_severity
\ No newline at end of file
+    rank = max((SEVERITY_ORDER.get(r.get("severity", "none"), 0) for r in results), default=0)
+    return SEVERITY_LEVELS[rank]
\ No newline at end of file
@@ -187,7 +187,7 @@ def parse_vcf(file_content: str) -> Dict:
         except Exception as e:
             parse_errors.append(f"Line {line_num}: {str(e)}")
 
-    detected_genes   = list(set(v["gene"] for v in variants))
+    detected_genes   = list(dict.fromkeys(v["gene"] for v in variants))
     variants_by_gene: Dict[str, List[Dict]] = {}
     for v in variants:
         variants_by_gene.setdefault(v["gene"], []).append(v)